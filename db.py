@@ -1,56 +1,37 @@
-from typing import List, Optional
-from dataclasses import dataclass
-from datetime import datetime
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+from operator import itemgetter
 import sqlite3
+import threading
+import time
 
 # Dataclasses for database objects
-@dataclass
+@dataclass(slots=True)
 class User:
     id: int
     username: str
     created_at: datetime
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "User":
-        return cls(
-            id=row["id"],
-            username=row["username"],
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Topic:
     id: int
     name: str
     description: Optional[str]
     created_at: datetime
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Topic":
-        return cls(
-            id=row["id"],
-            name=row["name"],
-            description=row["description"],
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Conversation:
     id: int
     topic_id: int
     name: str  # Added name field
     created_at: datetime
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Conversation":
-        return cls(
-            id=row["id"],
-            topic_id=row["topic_id"],
-            name=row["name"],  # Added name field
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Message:
     id: int
     conversation_id: int
@@ -58,17 +39,7 @@ class Message:
     content: str
     created_at: datetime
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Message":
-        return cls(
-            id=row["id"],
-            conversation_id=row["conversation_id"],
-            author_id=row["author_id"],
-            content=row["content"],
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Page:
     id: int
     topic_id: int
@@ -76,41 +47,20 @@ class Page:
     content: str
     created_at: datetime
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Page":
-        return cls(
-            id=row["id"],
-            topic_id=row["topic_id"],
-            title=row["title"],
-            content=row["content"],
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Participant:
     conversation_id: int
     user_id: int
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Participant":
-        return cls(
-            conversation_id=row["conversation_id"],
-            user_id=row["user_id"]
-        )
-
-@dataclass
+@dataclass(slots=True)
 class Subscription:
     topic_id: int
     user_id: int
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "Subscription":
-        return cls(
-            topic_id=row["topic_id"],
-            user_id=row["user_id"]
-        )
+# Released MessageWithAuthor instances waiting to be reused by MessageWithAuthor.obtain
+_message_pool: Deque["MessageWithAuthor"] = deque(maxlen=4096)
 
-@dataclass
+@dataclass(slots=True)
 class MessageWithAuthor:
     id: int
     conversation_id: int
@@ -120,26 +70,169 @@ class MessageWithAuthor:
     created_at: datetime
 
     @classmethod
-    def from_row(cls, row: sqlite3.Row) -> "MessageWithAuthor":
-        return cls(
-            id=row["id"],
-            conversation_id=row["conversation_id"],
-            author_id=row["author_id"],
-            author_name=row["author_name"],
-            content=row["content"],
-            created_at=datetime.fromisoformat(row["created_at"])
-        )
+    def obtain(cls, id: int, conversation_id: int, author_id: int, author_name: str, content: str, created_at: datetime) -> "MessageWithAuthor":
+        """
+        Return a MessageWithAuthor, reusing a released instance when one is available.
+        """
+        try:
+            message = _message_pool.pop()
+        except IndexError:
+            return cls(id, conversation_id, author_id, author_name, content, created_at)
+        message.id = id
+        message.conversation_id = conversation_id
+        message.author_id = author_id
+        message.author_name = author_name
+        message.content = content
+        message.created_at = created_at
+        return message
+
+    @staticmethod
+    def release_all(messages: Iterable["MessageWithAuthor"]) -> None:
+        """
+        Hand messages back for reuse. They must not be used after this call.
+        """
+        _message_pool.extend(messages)
+
+def _make_from_row(cls, factory=None) -> None:
+    """
+    Generate cls.from_row, which builds an instance from a row whose columns are in
+    field order. Like dataclass's own __init__, the body is compiled with exec so it
+    is a straight sequence of tuple indexes; datetime fields are parsed from ISO text.
+    """
+    args = []
+    for index, field in enumerate(fields(cls)):
+        if field.type is datetime:
+            args.append(f"_parse(row[{index}])")
+        else:
+            args.append(f"row[{index}]")
+    source = f"def from_row(row, _parse=_parse):\n    return factory({', '.join(args)})\n"
+    namespace = {}
+    exec(source, {"factory": factory or cls, "_parse": datetime.fromisoformat}, namespace)
+    cls.from_row = staticmethod(namespace["from_row"])
+
+for _cls in (User, Topic, Conversation, Message, Page, Participant, Subscription):
+    _make_from_row(_cls)
+_make_from_row(MessageWithAuthor, MessageWithAuthor.obtain)
 
 class TopicWithConversations:
     """Class representing a Topic with its associated Conversations."""
-    
+
+    __slots__ = ("id", "name", "description", "conversations")
+
     def __init__(self, topic, conversations=None):
         self.id = topic.id
         self.name = topic.name
         self.description = topic.description
         self.conversations = conversations or []
 
+def _utcnow() -> datetime:
+    """
+    Current UTC time as SQLite's CURRENT_TIMESTAMP stores it (naive, whole seconds).
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+# Read once per process and run with a single executescript on new databases.
+# Resolved next to this file so it doesn't depend on the working directory.
+SCHEMA_SQL = Path(__file__).with_name("schema.sql").read_text()
+
+# get_user is called on every request to resolve the X-User header, so found
+# users are cached per DatabaseAccess for a short time
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_SIZE = 4096
+
+# Applied to connections opened by DatabaseAccess. WAL with synchronous=NORMAL
+# avoids an fsync on every commit, which dominates small inserts.
+_SQL_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    """
+
+# Indexes for the list queries, run on every open so databases created before
+# they existed pick them up too. Participants is already covered by its
+# UNIQUE (conversation_id, user_id) constraint. Run one at a time with execute,
+# since executescript would first commit a transaction the caller has open.
+_SQL_CREATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON Messages (conversation_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_topic_created ON Conversations (topic_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_pages_topic_created ON Pages (topic_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON Subscriptions (user_id)",
+)
+
+# SQL statements used by DatabaseAccess. The connection's statement cache
+# (cached_statements) keeps the prepared form of each one between calls.
+_SQL_HAS_SCHEMA = "SELECT name FROM sqlite_master WHERE type='table' AND name='Users'"
+_SQL_COUNT_USERS = "SELECT COUNT(*) FROM Users"
+_SQL_BEGIN = "BEGIN"
+_SQL_SAVEPOINT = "SAVEPOINT db_transaction"
+_SQL_ROLLBACK_TO_SAVEPOINT = "ROLLBACK TO db_transaction"
+_SQL_RELEASE_SAVEPOINT = "RELEASE db_transaction"
+_SQL_INSERT_USER = "INSERT INTO Users (username) VALUES (?)"
+_SQL_GET_USER = "SELECT id, username, created_at FROM Users WHERE id = ?"
+_SQL_INSERT_TOPIC = "INSERT INTO Topics (name, description) VALUES (?, ?)"
+_SQL_GET_TOPIC = "SELECT id, name, description, created_at FROM Topics WHERE id = ?"
+_SQL_GET_TOPICS = "SELECT id, name, description, created_at FROM Topics"
+_SQL_INSERT_CONVERSATION = "INSERT INTO Conversations (topic_id, name) VALUES (?, ?)"
+_SQL_GET_CONVERSATION = "SELECT id, topic_id, name, created_at FROM Conversations WHERE id = ?"
+_SQL_GET_CONVERSATIONS_BY_TOPIC = "SELECT id, topic_id, name, created_at FROM Conversations WHERE topic_id = ? ORDER BY created_at ASC"
+_SQL_INSERT_MESSAGE = "INSERT INTO Messages (conversation_id, author_id, content) VALUES (?, ?, ?)"
+_SQL_GET_MESSAGES = """
+    SELECT Messages.id, Messages.conversation_id, Messages.author_id,
+           Users.username AS author_name, Messages.content, Messages.created_at
+    FROM Messages
+    INNER JOIN Users ON Messages.author_id = Users.id
+    WHERE Messages.conversation_id = ?
+    ORDER BY Messages.created_at ASC
+    LIMIT ? OFFSET ?
+    """
+_SQL_INSERT_PAGE = "INSERT INTO Pages (topic_id, title, content) VALUES (?, ?, ?)"
+_SQL_GET_PAGE = "SELECT id, topic_id, title, content, created_at FROM Pages WHERE id = ?"
+_SQL_GET_PAGES_BY_TOPIC = "SELECT id, topic_id, title, content, created_at FROM Pages WHERE topic_id = ? ORDER BY created_at ASC"
+_SQL_INSERT_PARTICIPANT = "INSERT INTO Participants (conversation_id, user_id) VALUES (?, ?)"
+_SQL_DELETE_PARTICIPANT = "DELETE FROM Participants WHERE conversation_id = ? AND user_id = ?"
+_SQL_GET_PARTICIPANTS = "SELECT conversation_id, user_id FROM Participants WHERE conversation_id = ?"
+_SQL_INSERT_SUBSCRIPTION = "INSERT INTO Subscriptions (topic_id, user_id) VALUES (?, ?)"
+_SQL_DELETE_SUBSCRIPTION = "DELETE FROM Subscriptions WHERE topic_id = ? AND user_id = ?"
+_SQL_GET_SUBSCRIPTIONS = "SELECT topic_id, user_id FROM Subscriptions WHERE user_id = ?"
+_SQL_GET_SUBSCRIBED_TOPICS = """
+    SELECT Topics.id, Topics.name, Topics.description, Topics.created_at,
+           Conversations.id, Conversations.topic_id, Conversations.name, Conversations.created_at
+    FROM Topics
+    INNER JOIN Subscriptions ON Topics.id = Subscriptions.topic_id
+    LEFT JOIN Conversations ON Conversations.topic_id = Topics.id
+    WHERE Subscriptions.user_id = ?
+    ORDER BY Topics.id, Conversations.created_at ASC, Conversations.id ASC
+    """
+
+# Seed data inserts, which resolve foreign keys by name
+_SQL_SEED_CONVERSATION = "INSERT INTO Conversations (topic_id, name) SELECT id, ? FROM Topics WHERE name = ?"
+_SQL_SEED_MESSAGE = """
+    INSERT INTO Messages (conversation_id, author_id, content)
+    SELECT Conversations.id, Users.id, ?
+    FROM Conversations, Users
+    WHERE Conversations.name = ? AND Users.username = ?
+    """
+_SQL_SEED_PAGE = "INSERT INTO Pages (topic_id, title, content) SELECT id, ?, ? FROM Topics WHERE name = ?"
+_SQL_SEED_PARTICIPANT = """
+    INSERT INTO Participants (conversation_id, user_id)
+    SELECT Conversations.id, Users.id
+    FROM Conversations, Users
+    WHERE Conversations.name = ? AND Users.username = ?
+    """
+_SQL_SEED_SUBSCRIPTION = """
+    INSERT INTO Subscriptions (topic_id, user_id)
+    SELECT Topics.id, Users.id
+    FROM Topics, Users
+    WHERE Topics.name = ? AND Users.username = ?
+    """
+
 class DatabaseAccess:
+    """
+    Access to the chat database. The get_* methods accept an optional cursor to run
+    on, so a caller making many reads can reuse one instead of allocating a cursor per call.
+    """
+
     def __init__(self, db_path: str = "", connection: Optional[sqlite3.Connection] = None, seed_data: bool = False):
         """
         Initialize the database connection. Optionally seed the database with dummy data.
@@ -149,14 +242,25 @@ class DatabaseAccess:
         if not db_path and not connection:
             raise ValueError("Specify either a database path or a connection")
         if db_path:
-            self.connection = sqlite3.connect(db_path)
+            # Shared with FastAPI's threadpool; sqlite serializes access to the connection
+            # isolation_level=None: no implicit BEGINs; transactions are opened explicitly
+            self.connection = sqlite3.connect(
+                db_path, isolation_level=None, check_same_thread=False, cached_statements=256
+            )
+            self.connection.executescript(_SQL_PRAGMAS)
         else:
             self.connection = connection
+        self._user_cache: Dict[int, Tuple[float, User]] = {}
+        self._begin_lock = threading.Lock()
+        # Set while a transaction opened by add_message_nocommit awaits commit(),
+        # so other writes know they may commit it along with their own
+        self._batch_open = False
+        self._savepoint_depth = 0
         # if the database is not initialized, run schema.sql
-        if self.connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='Users'").fetchone() is None:
-            with open("schema.sql") as f:
-                self.connection.executescript(f.read())
-        self.connection.row_factory = sqlite3.Row  # Enable named access to columns
+        if self.connection.execute(_SQL_HAS_SCHEMA).fetchone() is None:
+            self.connection.executescript(SCHEMA_SQL)
+        for statement in _SQL_CREATE_INDEXES:
+            self.connection.execute(statement)
 
         if seed_data:
             self._seed_database()
@@ -166,257 +270,358 @@ class DatabaseAccess:
         Seed the database with dummy data for testing and development.
         """
         # Check if the database is empty
-        user_count = self.connection.execute("SELECT COUNT(*) FROM Users").fetchone()[0]
+        user_count = self.connection.execute(_SQL_COUNT_USERS).fetchone()[0]
         if user_count > 0:
             return  # Database is not empty, skip seeding
 
-        # Create dummy users
-        user1 = self.create_user("alice")
-        user2 = self.create_user("bob")
-        user3 = self.create_user("charlie")
-
-        # Create dummy topics
-        topic1 = self.create_topic("General Discussion", "A place for general chat")
-        topic2 = self.create_topic("Tech Talk", "Discuss the latest in technology")
-        topic3 = self.create_topic("Random Thoughts", "Anything goes here")
-
-        # Create dummy conversations
-        conversation1 = self.create_conversation(topic1.id, "General Chat")
-        conversation2 = self.create_conversation(topic2.id, "Tech Updates")
-        conversation3 = self.create_conversation(topic3.id, "Random Musings")
-
-        # Add dummy messages
-        self.add_message(conversation1.id, user1.id, "Hello, everyone!")
-        self.add_message(conversation1.id, user2.id, "Hi Alice!")
-        self.add_message(conversation2.id, user1.id, "What's the latest in tech?")
-        self.add_message(conversation2.id, user3.id, "AI is taking over!")
-        self.add_message(conversation3.id, user2.id, "Random thoughts are the best.")
-        self.add_message(conversation3.id, user3.id, "I agree!")
-
-        # Create dummy pages
-        self.create_page(topic1.id, "Welcome", "Welcome to the General Discussion topic!")
-        self.create_page(topic2.id, "Tech Trends", "A summary of the latest trends in technology.")
-        self.create_page(topic3.id, "Random Ideas", "A collection of random ideas and thoughts.")
-
-        self.add_participant(conversation1.id, user1.id)
-        self.add_participant(conversation1.id, user2.id)
-        self.add_participant(conversation2.id, user1.id)
-        self.add_participant(conversation2.id, user3.id)
-        self.add_participant(conversation3.id, user2.id)
-
-        self.subscribe_to_topic(topic1.id, user1.id)
-        self.subscribe_to_topic(topic1.id, user2.id)
-        self.subscribe_to_topic(topic2.id, user1.id)
-        self.subscribe_to_topic(topic2.id, user3.id)
-        self.subscribe_to_topic(topic3.id, user2.id)
+        # Insert everything in one transaction. Rows refer to each other by name,
+        # resolved with subqueries, so no ids need to be read back.
+        with self.transaction():
+            # Create dummy users
+            self.connection.executemany(
+                _SQL_INSERT_USER,
+                [("alice",), ("bob",), ("charlie",)]
+            )
+
+            # Create dummy topics
+            self.connection.executemany(
+                _SQL_INSERT_TOPIC,
+                [
+                    ("General Discussion", "A place for general chat"),
+                    ("Tech Talk", "Discuss the latest in technology"),
+                    ("Random Thoughts", "Anything goes here"),
+                ]
+            )
+
+            # Create dummy conversations
+            self.connection.executemany(
+                _SQL_SEED_CONVERSATION,
+                [
+                    ("General Chat", "General Discussion"),
+                    ("Tech Updates", "Tech Talk"),
+                    ("Random Musings", "Random Thoughts"),
+                ]
+            )
+
+            # Add dummy messages
+            self.connection.executemany(
+                _SQL_SEED_MESSAGE,
+                [
+                    ("Hello, everyone!", "General Chat", "alice"),
+                    ("Hi Alice!", "General Chat", "bob"),
+                    ("What's the latest in tech?", "Tech Updates", "alice"),
+                    ("AI is taking over!", "Tech Updates", "charlie"),
+                    ("Random thoughts are the best.", "Random Musings", "bob"),
+                    ("I agree!", "Random Musings", "charlie"),
+                ]
+            )
+
+            # Create dummy pages
+            self.connection.executemany(
+                _SQL_SEED_PAGE,
+                [
+                    ("Welcome", "Welcome to the General Discussion topic!", "General Discussion"),
+                    ("Tech Trends", "A summary of the latest trends in technology.", "Tech Talk"),
+                    ("Random Ideas", "A collection of random ideas and thoughts.", "Random Thoughts"),
+                ]
+            )
+
+            self.connection.executemany(
+                _SQL_SEED_PARTICIPANT,
+                [
+                    ("General Chat", "alice"),
+                    ("General Chat", "bob"),
+                    ("Tech Updates", "alice"),
+                    ("Tech Updates", "charlie"),
+                    ("Random Musings", "bob"),
+                ]
+            )
+
+            self.connection.executemany(
+                _SQL_SEED_SUBSCRIPTION,
+                [
+                    ("General Discussion", "alice"),
+                    ("General Discussion", "bob"),
+                    ("Tech Talk", "alice"),
+                    ("Tech Talk", "charlie"),
+                    ("Random Thoughts", "bob"),
+                ]
+            )
+
+    def _execute_write(self, query: str, params: Sequence, many: bool = False) -> sqlite3.Cursor:
+        """
+        Execute a write (or, with many=True, executemany over a sequence of parameter
+        tuples) and commit it, unless the caller already has a transaction open
+        (e.g. a savepoint), in which case committing is left to the caller.
+        """
+        owns_transaction = self._owns_transaction()
+        if many and owns_transaction:
+            # With isolation_level=None each executemany row would otherwise
+            # autocommit on its own; the savepoint makes the batch one transaction
+            with self.transaction():
+                cursor = self.connection.executemany(query, params)
+        else:
+            execute = self.connection.executemany if many else self.connection.execute
+            cursor = execute(query, params)
+        if owns_transaction:
+            self.commit()
+        return cursor
+
+    def _owns_transaction(self) -> bool:
+        """
+        Whether a write may commit: no transaction is open, or the only one open is a
+        pending add_message_nocommit batch, which is then committed early.
+        """
+        return not self.connection.in_transaction or (self._batch_open and not self._savepoint_depth)
 
     def create_user(self, username: str) -> User:
         """
         Create a new user and return the User object.
         """
-        query = "INSERT INTO Users (username) VALUES (?)"
-        cursor = self.connection.execute(query, (username,))
-        self.connection.commit()
-        user_id = cursor.lastrowid
-        return self.get_user(user_id)
+        cursor = self._execute_write(_SQL_INSERT_USER, (username,))
+        return User(id=cursor.lastrowid, username=username, created_at=_utcnow())
 
-    def get_user(self, user_id: int) -> Optional[User]:
+    def get_user(self, user_id: int, cursor: Optional[sqlite3.Cursor] = None) -> Optional[User]:
         """
-        Retrieve a user by ID.
+        Retrieve a user by ID. Found users are cached for USER_CACHE_TTL_SECONDS.
         """
-        query = "SELECT * FROM Users WHERE id = ?"
-        cursor = self.connection.execute(query, (user_id,))
+        now = time.monotonic()
+        cached = self._user_cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        cursor = (cursor or self.connection).execute(_SQL_GET_USER, (user_id,))
         row = cursor.fetchone()
         if row:
-            return User.from_row(row)
+            user = User.from_row(row)
+            self._cache_user(user)
+            return user
         return None
 
+    def clear_user_cache(self) -> None:
+        """
+        Forget cached users, e.g. after rolling back writes that created them.
+        """
+        self._user_cache.clear()
+
+    def _cache_user(self, user: User) -> None:
+        if len(self._user_cache) >= USER_CACHE_MAX_SIZE:
+            self._user_cache.clear()
+        self._user_cache[user.id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+
     def create_topic(self, name: str, description: Optional[str] = None) -> Topic:
         """
         Create a new topic and return the Topic object.
         """
-        query = "INSERT INTO Topics (name, description) VALUES (?, ?)"
-        cursor = self.connection.execute(query, (name, description))
-        self.connection.commit()
-        topic_id = cursor.lastrowid
-        return self.get_topic(topic_id)
+        cursor = self._execute_write(_SQL_INSERT_TOPIC, (name, description))
+        return Topic(id=cursor.lastrowid, name=name, description=description, created_at=_utcnow())
 
-    def get_topic(self, topic_id: int) -> Optional[Topic]:
+    def get_topic(self, topic_id: int, cursor: Optional[sqlite3.Cursor] = None) -> Optional[Topic]:
         """
         Retrieve a topic by ID.
         """
-        query = "SELECT * FROM Topics WHERE id = ?"
-        cursor = self.connection.execute(query, (topic_id,))
+        cursor = (cursor or self.connection).execute(_SQL_GET_TOPIC, (topic_id,))
         row = cursor.fetchone()
         if row:
             return Topic.from_row(row)
         return None
 
-    def get_topics(self) -> List[Topic]:
+    def get_topics(self, cursor: Optional[sqlite3.Cursor] = None) -> List[Topic]:
         """
         Retrieve all topics.
         """
-        query = "SELECT * FROM Topics"
-        cursor = self.connection.execute(query)
-        rows = cursor.fetchall()
-        return [Topic.from_row(row) for row in rows]
+        cursor = (cursor or self.connection).execute(_SQL_GET_TOPICS)
+        return [Topic.from_row(row) for row in cursor]
 
     def create_conversation(self, topic_id: int, name: str) -> Conversation:
         """
         Create a new conversation under a topic and return the Conversation object.
         """
-        query = "INSERT INTO Conversations (topic_id, name) VALUES (?, ?)"
-        cursor = self.connection.execute(query, (topic_id, name))
-        self.connection.commit()
-        conversation_id = cursor.lastrowid
-        return self.get_conversation(conversation_id)
+        cursor = self._execute_write(_SQL_INSERT_CONVERSATION, (topic_id, name))
+        return Conversation(id=cursor.lastrowid, topic_id=topic_id, name=name, created_at=_utcnow())
 
-    def get_conversation(self, conversation_id: int) -> Optional[Conversation]:
+    def get_conversation(self, conversation_id: int, cursor: Optional[sqlite3.Cursor] = None) -> Optional[Conversation]:
         """
         Retrieve a conversation by ID.
         """
-        query = "SELECT * FROM Conversations WHERE id = ?"
-        cursor = self.connection.execute(query, (conversation_id,))
+        cursor = (cursor or self.connection).execute(_SQL_GET_CONVERSATION, (conversation_id,))
         row = cursor.fetchone()
         if row:
             return Conversation.from_row(row)
         return None
 
-    def get_conversations_by_topic(self, topic_id: int) -> List[Conversation]:
+    def get_conversations_by_topic(self, topic_id: int, cursor: Optional[sqlite3.Cursor] = None) -> List[Conversation]:
         """
         Retrieve all conversations under a specific topic.
         """
-        query = "SELECT * FROM Conversations WHERE topic_id = ? ORDER BY created_at ASC"
-        cursor = self.connection.execute(query, (topic_id,))
-        rows = cursor.fetchall()
-        return [Conversation.from_row(row) for row in rows]
+        cursor = (cursor or self.connection).execute(_SQL_GET_CONVERSATIONS_BY_TOPIC, (topic_id,))
+        return [Conversation.from_row(row) for row in cursor]
 
     def add_message(self, conversation_id: int, author_id: int, content: str) -> Message:
         """
         Add a message to a conversation and return the Message object.
         """
-        query = "INSERT INTO Messages (conversation_id, author_id, content) VALUES (?, ?, ?)"
-        cursor = self.connection.execute(query, (conversation_id, author_id, content))
-        self.connection.commit()
-        message_id = cursor.lastrowid
-        query = "SELECT * FROM Messages WHERE id = ?"
-        row = self.connection.execute(query, (message_id,)).fetchone()
-        return Message.from_row(row)
+        owns_transaction = self._owns_transaction()
+        message = self.add_message_nocommit(conversation_id, author_id, content)
+        if owns_transaction:
+            self.commit()
+        return message
 
-    def get_messages(self, conversation_id: int, limit: int, offset: int) -> List[MessageWithAuthor]:
+    def add_messages(self, conversation_id: int, author_id: int, contents: List[str]) -> None:
         """
-        Retrieve messages for a conversation with pagination, including the author's name.
+        Add several messages by one author to a conversation with a single executemany,
+        committed together.
+        """
+        rows = [(conversation_id, author_id, content) for content in contents]
+        self._execute_write(_SQL_INSERT_MESSAGE, rows, many=True)
+
+    def add_message_nocommit(self, conversation_id: int, author_id: int, content: str) -> Message:
         """
-        query = """
-        SELECT Messages.*, Users.username AS author_name
-        FROM Messages
-        INNER JOIN Users ON Messages.author_id = Users.id
-        WHERE Messages.conversation_id = ?
-        ORDER BY Messages.created_at ASC
-        LIMIT ? OFFSET ?
+        Add a message to a conversation without committing. The caller is responsible
+        for calling commit(), which lets bursts of messages share one transaction.
         """
-        cursor = self.connection.execute(query, (conversation_id, limit, offset))
-        rows = cursor.fetchall()
-        return [MessageWithAuthor.from_row(row) for row in rows]
+        with self._begin_lock:
+            if not self.connection.in_transaction:
+                self.connection.execute(_SQL_BEGIN)
+                self._batch_open = True
+        cursor = self.connection.execute(_SQL_INSERT_MESSAGE, (conversation_id, author_id, content))
+        return Message(
+            id=cursor.lastrowid,
+            conversation_id=conversation_id,
+            author_id=author_id,
+            content=content,
+            created_at=_utcnow()
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Group several writes into one transaction. This is a savepoint, so it also nests
+        inside a transaction the caller already has open. The writes are rolled back if
+        the block raises.
+        """
+        self.connection.execute(_SQL_SAVEPOINT)
+        self._savepoint_depth += 1
+        try:
+            yield
+        except BaseException:
+            self.connection.execute(_SQL_ROLLBACK_TO_SAVEPOINT)
+            self.connection.execute(_SQL_RELEASE_SAVEPOINT)
+            # Users read inside the block may no longer exist
+            self.clear_user_cache()
+            raise
+        else:
+            self.connection.execute(_SQL_RELEASE_SAVEPOINT)
+        finally:
+            self._savepoint_depth -= 1
+
+    def commit(self) -> None:
+        """
+        Commit any pending writes, e.g. from add_message_nocommit.
+        """
+        # Under the lock so a batch opened right after the commit keeps its flag
+        with self._begin_lock:
+            self.connection.commit()
+            self._batch_open = False
+
+    def rollback(self) -> None:
+        """
+        Discard any pending writes, e.g. after commit() failed.
+        """
+        with self._begin_lock:
+            self.connection.rollback()
+            self._batch_open = False
+        self.clear_user_cache()
+
+    def get_messages(self, conversation_id: int, limit: int, offset: int, cursor: Optional[sqlite3.Cursor] = None) -> List[MessageWithAuthor]:
+        """
+        Retrieve messages for a conversation with pagination, including the author's name.
+        """
+        cursor = (cursor or self.connection).execute(_SQL_GET_MESSAGES, (conversation_id, limit, offset))
+        return [MessageWithAuthor.from_row(row) for row in cursor]
 
     def create_page(self, topic_id: int, title: str, content: str) -> Page:
         """
         Create a new page under a topic and return the Page object.
         """
-        query = "INSERT INTO Pages (topic_id, title, content) VALUES (?, ?, ?)"
-        cursor = self.connection.execute(query, (topic_id, title, content))
-        self.connection.commit()
-        page_id = cursor.lastrowid
-        return self.get_page(page_id)
+        cursor = self._execute_write(_SQL_INSERT_PAGE, (topic_id, title, content))
+        return Page(id=cursor.lastrowid, topic_id=topic_id, title=title, content=content, created_at=_utcnow())
 
-    def get_page(self, page_id: int) -> Optional[Page]:
+    def get_page(self, page_id: int, cursor: Optional[sqlite3.Cursor] = None) -> Optional[Page]:
         """
         Retrieve a page by ID.
         """
-        query = "SELECT * FROM Pages WHERE id = ?"
-        cursor = self.connection.execute(query, (page_id,))
+        cursor = (cursor or self.connection).execute(_SQL_GET_PAGE, (page_id,))
         row = cursor.fetchone()
         if row:
             return Page.from_row(row)
         return None
 
-    def get_pages_by_topic(self, topic_id: int) -> List[Page]:
+    def get_pages_by_topic(self, topic_id: int, cursor: Optional[sqlite3.Cursor] = None) -> List[Page]:
         """
         Retrieve all pages under a specific topic.
         """
-        query = "SELECT * FROM Pages WHERE topic_id = ? ORDER BY created_at ASC"
-        cursor = self.connection.execute(query, (topic_id,))
-        rows = cursor.fetchall()
-        return [Page.from_row(row) for row in rows]
+        cursor = (cursor or self.connection).execute(_SQL_GET_PAGES_BY_TOPIC, (topic_id,))
+        return [Page.from_row(row) for row in cursor]
 
     def add_participant(self, conversation_id: int, user_id: int) -> Participant:
         """
         Add a participant to a conversation and return the Participant object.
         """
-        query = "INSERT INTO Participants (conversation_id, user_id) VALUES (?, ?)"
-        self.connection.execute(query, (conversation_id, user_id))
-        self.connection.commit()
+        self._execute_write(_SQL_INSERT_PARTICIPANT, (conversation_id, user_id))
         return Participant(conversation_id=conversation_id, user_id=user_id)
 
     def remove_participant(self, conversation_id: int, user_id: int) -> None:
         """
         Remove a participant from a conversation.
         """
-        query = "DELETE FROM Participants WHERE conversation_id = ? AND user_id = ?"
-        self.connection.execute(query, (conversation_id, user_id))
-        self.connection.commit()
+        self._execute_write(_SQL_DELETE_PARTICIPANT, (conversation_id, user_id))
 
-    def get_participants(self, conversation_id: int) -> List[Participant]:
+    def get_participants(self, conversation_id: int, cursor: Optional[sqlite3.Cursor] = None) -> List[Participant]:
         """
         Retrieve all participants for a conversation.
         """
-        query = "SELECT * FROM Participants WHERE conversation_id = ?"
-        cursor = self.connection.execute(query, (conversation_id,))
-        rows = cursor.fetchall()
-        return [Participant.from_row(row) for row in rows]
+        cursor = (cursor or self.connection).execute(_SQL_GET_PARTICIPANTS, (conversation_id,))
+        return [Participant.from_row(row) for row in cursor]
 
     def subscribe_to_topic(self, topic_id: int, user_id: int) -> Subscription:
         """
         Subscribe a user to a topic and return the Subscription object.
         """
-        query = "INSERT INTO Subscriptions (topic_id, user_id) VALUES (?, ?)"
-        self.connection.execute(query, (topic_id, user_id))
-        self.connection.commit()
+        self._execute_write(_SQL_INSERT_SUBSCRIPTION, (topic_id, user_id))
         return Subscription(topic_id=topic_id, user_id=user_id)
 
+    def bulk_subscribe(self, user_id: int, topic_ids: List[int]) -> List[Subscription]:
+        """
+        Subscribe a user to several topics with a single executemany and return the Subscription objects.
+        Either every subscription is added or, if one fails, none are.
+        """
+        self._execute_write(_SQL_INSERT_SUBSCRIPTION, [(topic_id, user_id) for topic_id in topic_ids], many=True)
+        return [Subscription(topic_id=topic_id, user_id=user_id) for topic_id in topic_ids]
+
     def unsubscribe_from_topic(self, topic_id: int, user_id: int) -> None:
         """
         Unsubscribe a user from a topic.
         """
-        query = "DELETE FROM Subscriptions WHERE topic_id = ? AND user_id = ?"
-        self.connection.execute(query, (topic_id, user_id))
-        self.connection.commit()
+        self._execute_write(_SQL_DELETE_SUBSCRIPTION, (topic_id, user_id))
 
-    def get_subscriptions(self, user_id: int) -> List[Subscription]:
+    def get_subscriptions(self, user_id: int, cursor: Optional[sqlite3.Cursor] = None) -> List[Subscription]:
         """
         Retrieve all topics a user is subscribed to.
         """
-        query = "SELECT * FROM Subscriptions WHERE user_id = ?"
-        cursor = self.connection.execute(query, (user_id,))
-        rows = cursor.fetchall()
-        return [Subscription.from_row(row) for row in rows]
+        cursor = (cursor or self.connection).execute(_SQL_GET_SUBSCRIPTIONS, (user_id,))
+        return [Subscription.from_row(row) for row in cursor]
 
-    def get_subscribed_topics(self, user_id: int) -> List[TopicWithConversations]:
+    def get_subscribed_topics(self, user_id: int, cursor: Optional[sqlite3.Cursor] = None) -> List[TopicWithConversations]:
         """
         Retrieve all topics a user is subscribed to.
         """
-        query = """
-        SELECT Topics.*
-        FROM Topics
-        INNER JOIN Subscriptions ON Topics.id = Subscriptions.topic_id
-        WHERE Subscriptions.user_id = ?
-        """
-        cursor = self.connection.execute(query, (user_id,))
-        rows = cursor.fetchall()
+        cursor = (cursor or self.connection).execute(_SQL_GET_SUBSCRIBED_TOPICS, (user_id,))
         topics_with_conversations = []
-        for row in rows:
-            topic = Topic.from_row(row)
-            conversations = self.get_conversations_by_topic(topic.id)
-            topic_with_conversations = TopicWithConversations(topic, conversations)
-            topics_with_conversations.append(topic_with_conversations)
+        # Rows arrive ordered by topic, one per conversation (or a single row with
+        # NULL conversation columns for a topic that has none)
+        for _, rows in groupby(cursor, key=itemgetter(0)):
+            rows = list(rows)
+            topic = Topic.from_row(rows[0])
+            conversations = [Conversation.from_row(row[4:]) for row in rows if row[4] is not None]
+            topics_with_conversations.append(TopicWithConversations(topic, conversations))
         return topics_with_conversations
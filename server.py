@@ -1,78 +1,154 @@
-from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, Form
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, Form
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from db import DatabaseAccess
+from starlette.concurrency import run_in_threadpool
+from db import DatabaseAccess, MessageWithAuthor, User
+from contextlib import asynccontextmanager
+import asyncio
 import logging
+from typing import Dict, Optional, Set
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Flush the last batch of websocket messages; they were already broadcast
+    if pending_commit is not None:
+        await pending_commit
+    await run_in_threadpool(db.commit)
+
+app = FastAPI(lifespan=lifespan)
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Initialize the database with seed data
+# Initialize the database with seed data.
+# HTTP handlers are plain functions so FastAPI runs them (and their blocking
+# sqlite calls) in its threadpool; the websocket handler offloads explicitly.
 db = DatabaseAccess(db_path="chat.db", seed_data=True)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# In-memory store for active WebSocket connections
-active_connections = {}
+# In-memory store for active WebSocket connections, keyed by the conversation
+# each client is viewing so messages only go to that conversation's viewers
+active_connections: Dict[int, Set[WebSocket]] = {}
+
+def move_connection(websocket: WebSocket, old_conversation_id: Optional[int], new_conversation_id: Optional[int]):
+    if old_conversation_id is not None:
+        viewers = active_connections.get(old_conversation_id)
+        if viewers is not None:
+            viewers.discard(websocket)
+            if not viewers:
+                del active_connections[old_conversation_id]
+    if new_conversation_id is not None:
+        active_connections.setdefault(new_conversation_id, set()).add(websocket)
+
+# Websocket messages are inserted without committing and flushed together on a
+# short timer, so a burst of chat messages costs one commit instead of one each
+COMMIT_INTERVAL_SECONDS = 0.05
+pending_commit = None
+
+async def commit_after_interval():
+    global pending_commit
+    await asyncio.sleep(COMMIT_INTERVAL_SECONDS)
+    pending_commit = None
+    try:
+        await run_in_threadpool(db.commit)
+    except Exception:
+        # Don't leave the transaction open for later writes to pile into
+        logging.exception("Failed to commit batched messages, rolling them back")
+        await run_in_threadpool(db.rollback)
+
+def schedule_commit():
+    global pending_commit
+    if pending_commit is None:
+        pending_commit = asyncio.create_task(commit_after_interval())
+
+# Compiled once; the templates environment autoescapes the username and message
+message_template = templates.get_template("message.html")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, x_user: int = Header(default=1)):
-    logging.info(f"Received WebSocket connection request with x_user: {x_user}")
+    logging.info("Received WebSocket connection request with x_user: %s", x_user)
     if x_user is None:
         await websocket.close(code=4001)
         logging.error("Missing x_user header")
         return
 
-    user = db.get_user(x_user)
+    user = await run_in_threadpool(db.get_user, x_user)
     if not user:
         await websocket.close(code=4004)
-        logging.error(f"User {x_user} not found")
+        logging.error("User %s not found", x_user)
         return
 
-    # Add the connection to the in-memory store
-    active_connections[x_user] = websocket
-    logging.info(f"User {x_user} connected via WebSocket.")
+    logging.info("User %s connected via WebSocket.", x_user)
+    # Clients send {"type": "join", "conversation_id": ...} when they open a
+    # conversation; message frames also carry the conversation being viewed
+    conversation_id = None
     try:
         await websocket.accept()
         while True:
             data = await websocket.receive_json()
-            logging.info(f"Received message from user {x_user}: {data}")
+            logging.info("Received message from user %s: %s", x_user, data)
+            try:
+                frame_conversation_id = int(data.get("conversation_id"))
+            except (TypeError, ValueError):
+                await websocket.send_text("Invalid message format.")
+                continue
+            # Also re-register if a failed broadcast send dropped this socket
+            if (frame_conversation_id != conversation_id
+                    or websocket not in active_connections.get(frame_conversation_id, ())):
+                move_connection(websocket, conversation_id, frame_conversation_id)
+                conversation_id = frame_conversation_id
+            if data.get("type") == "join":
+                continue
+
             message = data.get("message")
-            logging.info(f"Author: {user}, Message: {message}")
+            logging.info("Author: %s, Message: %s", user, message)
 
             if not user or not message:
                 await websocket.send_text("Invalid message format.")
                 continue
 
             # Save the message to the database
-            db.add_message(data.get("conversation_id"), user.id, message)
+            await run_in_threadpool(db.add_message_nocommit, conversation_id, user.id, message)
+            schedule_commit()
 
-            # Broadcast the message as an HTML snippet
+            # Broadcast the message as an HTML snippet to everyone viewing the conversation
             # This snipped will be inserted as the last child of the 'messages' element.
-            # Careful if the user changes conversations!
-            html_snippet = f"<p class=\"message\" id=\"messages\" hx-swap-oob=\"beforeend\"><strong>{user.username}:</strong> {message}</p>"
-            for user_id, connection in active_connections.items():
-                # DO send the message back to the sender
-                await connection.send_text(html_snippet)
+            html_snippet = message_template.render(username=user.username, message=message)
+            # Fan out concurrently so one slow client doesn't hold up the rest.
+            # DO send the message back to the sender
+            recipients = list(active_connections.get(conversation_id, ()))
+            results = await asyncio.gather(
+                *(connection.send_text(html_snippet) for connection in recipients),
+                return_exceptions=True,
+            )
+            for connection, result in zip(recipients, results):
+                if isinstance(result, Exception):
+                    logging.info("Dropping connection in conversation %s: %r", conversation_id, result)
+                    move_connection(connection, conversation_id, None)
     except WebSocketDisconnect:
-        logging.info(f"User {x_user} disconnected.")
+        logging.info("User %s disconnected.", x_user)
     finally:
         # Remove the connection from the in-memory store
-        active_connections.pop(x_user, None)
+        move_connection(websocket, conversation_id, None)
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request, x_user: int = Header(default=1)):
+def current_user(x_user: int = Header(default=1)) -> User:
+    """
+    Resolve the X-User header to a User, for use as a FastAPI dependency.
+    """
     if x_user is None:
         raise HTTPException(status_code=400, detail="Missing x_user header")
 
     user = db.get_user(x_user)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    return user
 
+@app.get("/", response_class=HTMLResponse)
+def read_root(request: Request, user: User = Depends(current_user)):
     topics = db.get_subscribed_topics(user.id)
     
     # Collect all conversations from all topics
@@ -91,41 +167,32 @@ async def read_root(request: Request, x_user: int = Header(default=1)):
         "messages": messages,
         "user": user,
     }
-    return templates.TemplateResponse("index.html", data)
+    response = templates.TemplateResponse("index.html", data)
+    # The template is rendered at this point, so the messages can be recycled
+    MessageWithAuthor.release_all(messages)
+    return response
 
 @app.get("/conversation/{id}", response_class=HTMLResponse)
-async def get_conversation(request: Request, id: int, x_user: int = Header(default=1)):
-    logging.info(f"Received request at '/conversation/{id}' with x_user: {x_user}")
-    if x_user is None:
-        raise HTTPException(status_code=400, detail="Missing x_user header")
-
-    user = db.get_user(x_user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+def get_conversation(request: Request, id: int, user: User = Depends(current_user)):
+    logging.info("Received request at '/conversation/%s' from user %s", id, user.id)
     conversation = db.get_conversation(id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     messages = db.get_messages(conversation.id, limit=10, offset=0)
-    print("Messages: ", messages)
     data = {
         "request": request,
         "conversation_id": conversation.id,
         "messages": messages,
         "user": user,
     }
-    return templates.TemplateResponse("conversation.html", data)
+    response = templates.TemplateResponse("conversation.html", data)
+    # The template is rendered at this point, so the messages can be recycled
+    MessageWithAuthor.release_all(messages)
+    return response
 
 @app.api_route("/topics", methods=["GET", "POST"], response_class=HTMLResponse)
-async def topics(request: Request, x_user: int = Header(default=1), topic_name: str = Form(default=None)):
-    if x_user is None:
-        raise HTTPException(status_code=400, detail="Missing x_user header")
-
-    user = db.get_user(x_user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+def topics(request: Request, user: User = Depends(current_user), topic_name: str = Form(default=None)):
     if request.method == "POST":
         if not topic_name:
             raise HTTPException(status_code=400, detail="Topic name is required")
@@ -143,14 +210,7 @@ async def topics(request: Request, x_user: int = Header(default=1), topic_name:
     return templates.TemplateResponse("topics.html", data)
 
 @app.get("/topics/{topic_id}/conversations", response_class=HTMLResponse)
-async def get_conversations_for_topic(request: Request, topic_id: int, x_user: int = Header(default=1)):
-    if x_user is None:
-        raise HTTPException(status_code=400, detail="Missing x_user header")
-
-    user = db.get_user(x_user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+def get_conversations_for_topic(request: Request, topic_id: int, user: User = Depends(current_user)):
     topic = db.get_topic(topic_id)
     if not topic:
         raise HTTPException(status_code=404, detail="Topic not found")
@@ -165,20 +225,13 @@ async def get_conversations_for_topic(request: Request, topic_id: int, x_user: i
     return templates.TemplateResponse("conversations.html", data)
 
 @app.api_route("/create_conversation/topic/{topic_id}", methods=["GET", "POST"], response_class=HTMLResponse)
-async def create_conversation(
+def create_conversation(
     request: Request, 
     topic_id: int,
-    x_user: int = Header(default=1), 
+    user: User = Depends(current_user),
     conversation_name: str = Form(None),
     first_message: str = Form(None)
 ):
-    if x_user is None:
-        raise HTTPException(status_code=400, detail="Missing x_user header")
-
-    user = db.get_user(x_user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     if request.method == "POST":
         if not topic_id or not conversation_name or not first_message:
             raise HTTPException(status_code=400, detail="Missing required fields")
@@ -198,7 +251,10 @@ async def create_conversation(
             "conversation_id": conversation.id,
             "messages": messages,
         }
-        return templates.TemplateResponse("conversation.html", data)
+        response = templates.TemplateResponse("conversation.html", data)
+        # The template is rendered at this point, so the messages can be recycled
+        MessageWithAuthor.release_all(messages)
+        return response
     
     # For GET requests, return the create conversation form
     if not topic_id:
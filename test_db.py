@@ -1,177 +1,297 @@
 import unittest
 import sqlite3
-from db import DatabaseAccess, User, Topic, Conversation, Message, Page, Participant, Subscription
-import os
-from db import TopicWithConversations
+from unittest.mock import patch
+from db import DatabaseAccess, USER_CACHE_TTL_SECONDS
 
 class TestDatabaseAccess(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # One in-memory SQLite database, schema created once, shared by every test.
+        # It is a named shared-cache database, so further connections opened in this
+        # process see the same schema and DatabaseAccess skips re-running it. They
+        # don't see test data: each test writes inside an open savepoint, so another
+        # connection reading those tables gets "database table is locked".
+        cls.connection = sqlite3.connect(
+            "file:test_db?mode=memory&cache=shared",
+            uri=True, isolation_level=None, check_same_thread=False, cached_statements=256
+        )
+        # Durability doesn't matter for a throwaway database
+        cls.connection.executescript(
+            "PRAGMA journal_mode=MEMORY; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY; "
+            "PRAGMA locking_mode=EXCLUSIVE; PRAGMA cache_size=-20000;"
+        )
+        cls.db = DatabaseAccess(connection=cls.connection)
+        # Baseline rows most tests need, created once outside any test savepoint
+        with cls.db.transaction():
+            cls.user_id = cls.db.create_user("test_user").id
+            cls.topic_id = cls.db.create_topic("test_topic", "description").id
+            cls.conversation_id = cls.db.create_conversation(cls.topic_id, "Test Conversation").id
+        # Gather planner statistics once so the read queries start with their plans settled
+        cls.connection.executescript("ANALYZE; PRAGMA optimize;")
+
+    @classmethod
+    def tearDownClass(cls):
+        # Close the database connection
+        cls.connection.close()
+
     def setUp(self):
-        # Set up an in-memory SQLite database
-        self.connection = sqlite3.connect(":memory:")
-        self.db = DatabaseAccess(connection=self.connection)
+        # Each test runs inside a savepoint that is rolled back afterwards
+        self.connection.execute("SAVEPOINT test")
+        # Reads share one cursor rather than allocating one per call
+        self.cursor = self.connection.cursor()
 
     def tearDown(self):
-        # Close the database connection
-        self.connection.close()
+        self.cursor.close()
+        self.connection.execute("ROLLBACK TO test")
+        self.connection.execute("RELEASE test")
+        # Users cached during the test may have been rolled back
+        self.db.clear_user_cache()
 
     def test_create_user(self):
-        user = self.db.create_user("test_user")
-        self.assertEqual(user.username, "test_user")
+        user = self.db.create_user("new_user")
+        self.assertEqual(user.username, "new_user")
 
     def test_get_user(self):
-        user = self.db.create_user("test_user")
-        fetched_user = self.db.get_user(user.id)
+        fetched_user = self.db.get_user(self.user_id, cursor=self.cursor)
         self.assertEqual(fetched_user.username, "test_user")
 
+    def test_get_user_is_cached(self):
+        # Inserted and renamed behind DatabaseAccess's back, so only the cache explains a stale read
+        user_id = self.cursor.execute("INSERT INTO Users (username) VALUES ('raw_user')").lastrowid
+        with patch("db.time.monotonic", return_value=1000.0):
+            user = self.db.get_user(user_id, cursor=self.cursor)
+            self.cursor.execute("UPDATE Users SET username = 'renamed_user' WHERE id = ?", (user_id,))
+            self.assertIs(self.db.get_user(user_id, cursor=self.cursor), user)
+        with patch("db.time.monotonic", return_value=1000.0 + USER_CACHE_TTL_SECONDS):
+            self.assertEqual(self.db.get_user(user_id, cursor=self.cursor).username, "renamed_user")
+
+    def test_get_user_missing_is_not_cached(self):
+        self.assertIsNone(self.db.get_user(9999, cursor=self.cursor))
+        self.cursor.execute("INSERT INTO Users (id, username) VALUES (9999, 'late_user')")
+        self.assertEqual(self.db.get_user(9999, cursor=self.cursor).username, "late_user")
+
+    def test_get_user_after_rolled_back_create(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                user = self.db.create_user("ghost")
+                self.db.get_user(user.id, cursor=self.cursor)
+                raise RuntimeError
+        self.assertIsNone(self.db.get_user(user.id, cursor=self.cursor))
+
     def test_create_topic(self):
-        topic = self.db.create_topic("test_topic", "description")
-        self.assertEqual(topic.name, "test_topic")
+        topic = self.db.create_topic("new_topic", "description")
+        self.assertEqual(topic.name, "new_topic")
 
     def test_get_topic(self):
-        topic = self.db.create_topic("test_topic", "description")
-        fetched_topic = self.db.get_topic(topic.id)
+        fetched_topic = self.db.get_topic(self.topic_id, cursor=self.cursor)
         self.assertEqual(fetched_topic.name, "test_topic")
 
     def test_get_topics(self):
-        self.db.create_topic("test_topic_1", "description_1")
-        self.db.create_topic("test_topic_2", "description_2")
-        topics = self.db.get_topics()
-        self.assertEqual(len(topics), 2)
+        with self.db.transaction():
+            self.db.create_topic("test_topic_1", "description_1")
+            self.db.create_topic("test_topic_2", "description_2")
+        topics = self.db.get_topics(cursor=self.cursor)
+        self.assertEqual([t.name for t in topics], ["test_topic", "test_topic_1", "test_topic_2"])
 
     def test_create_conversation(self):
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        self.assertEqual(conversation.topic_id, topic.id)
-        self.assertEqual(conversation.name, "Test Conversation")  # Verify name field
+        conversation = self.db.create_conversation(self.topic_id, "New Conversation")
+        self.assertEqual((conversation.topic_id, conversation.name), (self.topic_id, "New Conversation"))  # Verify name field
 
     def test_get_conversation(self):
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        fetched_conversation = self.db.get_conversation(conversation.id)
-        self.assertEqual(fetched_conversation.id, conversation.id)
-        self.assertEqual(fetched_conversation.name, "Test Conversation")  # Verify name field
+        fetched_conversation = self.db.get_conversation(self.conversation_id, cursor=self.cursor)
+        self.assertEqual((fetched_conversation.id, fetched_conversation.name), (self.conversation_id, "Test Conversation"))  # Verify name field
 
     def test_get_conversations_by_topic(self):
-        topic = self.db.create_topic("test_topic", "description")
-        self.db.create_conversation(topic.id, "Conversation 1")
-        self.db.create_conversation(topic.id, "Conversation 2")
-        conversations = self.db.get_conversations_by_topic(topic.id)
-        self.assertEqual(len(conversations), 2)
-        self.assertEqual(conversations[0].name, "Conversation 1")  # Verify name field
-        self.assertEqual(conversations[1].name, "Conversation 2")  # Verify name field
+        with self.db.transaction():
+            topic = self.db.create_topic("other_topic", "description")
+            self.db.create_conversation(topic.id, "Conversation 1")
+            self.db.create_conversation(topic.id, "Conversation 2")
+        conversations = self.db.get_conversations_by_topic(topic.id, cursor=self.cursor)
+        self.assertEqual([c.name for c in conversations], ["Conversation 1", "Conversation 2"])  # Verify name field
 
     def test_add_message(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")  # Added name
-        message = self.db.add_message(conversation.id, user.id, "Hello, world!")
+        message = self.db.add_message(self.conversation_id, self.user_id, "Hello, world!")
         self.assertEqual(message.content, "Hello, world!")
 
     def test_get_messages(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        for i in range(15):
-            self.db.add_message(conversation.id, user.id, f"Message {i + 1}")
-        messages = self.db.get_messages(conversation.id, limit=5, offset=5)
-        self.assertEqual(len(messages), 5)
-        self.assertEqual(messages[0].content, "Message 6")
-        self.assertEqual(messages[0].author_name, "test_user")  # Verify author's name
-        self.assertEqual(messages[4].content, "Message 10")
-        self.assertEqual(messages[4].author_name, "test_user")  # Verify author's name
+        self.db.add_messages(self.conversation_id, self.user_id, [f"Message {i + 1}" for i in range(15)])
+        messages = self.db.get_messages(self.conversation_id, limit=5, offset=5, cursor=self.cursor)
+        # Verify content and author's name for the whole page
+        self.assertEqual(
+            [(m.content, m.author_name) for m in messages],
+            [(f"Message {i}", "test_user") for i in range(6, 11)]
+        )
+
+    def test_release_messages_reuses_instances(self):
+        from db import MessageWithAuthor
+
+        self.db.add_message(self.conversation_id, self.user_id, "First")
+        first = self.db.get_messages(self.conversation_id, limit=1, offset=0, cursor=self.cursor)
+        MessageWithAuthor.release_all(first)
+        self.db.add_message(self.conversation_id, self.user_id, "Second")
+        second = self.db.get_messages(self.conversation_id, limit=1, offset=1, cursor=self.cursor)
+        self.assertIs(second[0], first[0])
+        self.assertEqual(second[0].content, "Second")
+
+    def standalone_db(self):
+        # A private database without the per-test savepoint open, for tests about commits
+        connection = sqlite3.connect(":memory:", isolation_level=None)
+        self.addCleanup(connection.close)
+        return connection, DatabaseAccess(connection=connection)
+
+    def test_seed_database(self):
+        connection = sqlite3.connect(":memory:", isolation_level=None)
+        self.addCleanup(connection.close)
+        DatabaseAccess(connection=connection, seed_data=True)
+        tables = ["Users", "Topics", "Conversations", "Messages", "Pages", "Participants", "Subscriptions"]
+        counts = [connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables]
+        self.assertEqual(counts, [3, 3, 3, 6, 3, 5, 5])
+        # Names in the seed rows resolve to the right foreign keys
+        author_and_conversation = connection.execute(
+            "SELECT Users.username, Conversations.name FROM Messages "
+            "JOIN Users ON Users.id = Messages.author_id "
+            "JOIN Conversations ON Conversations.id = Messages.conversation_id "
+            "WHERE Messages.content = 'Hi Alice!'"
+        ).fetchone()
+        self.assertEqual(author_and_conversation, ("bob", "General Chat"))
+
+    def test_wrapping_keeps_caller_transaction_open(self):
+        connection, db = self.standalone_db()
+        connection.execute("SAVEPOINT outer")
+        db.create_topic("test_topic")
+        DatabaseAccess(connection=connection)
+        connection.execute("ROLLBACK TO outer")
+        connection.execute("RELEASE outer")
+        self.assertEqual(db.get_topics(), [])
+
+    def test_write_commits_pending_message_batch(self):
+        connection, db = self.standalone_db()
+        user = db.create_user("test_user")
+        conversation = db.create_conversation(db.create_topic("test_topic").id, "Test Conversation")
+        db.add_message_nocommit(conversation.id, user.id, "Hello")
+        db.create_topic("other_topic")
+        self.assertFalse(connection.in_transaction)
+
+    def test_add_messages_commits_once(self):
+        connection, db = self.standalone_db()
+        user = db.create_user("test_user")
+        conversation = db.create_conversation(db.create_topic("test_topic").id, "Test Conversation")
+        statements = []
+        connection.set_trace_callback(statements.append)
+        db.add_messages(conversation.id, user.id, ["First", "Second", "Third"])
+        connection.set_trace_callback(None)
+        self.assertEqual(
+            [s for s in statements if not s.startswith("INSERT")],
+            ["SAVEPOINT db_transaction", "RELEASE db_transaction"]
+        )
+
+    def test_failed_bulk_write_leaves_nothing(self):
+        connection, db = self.standalone_db()
+        user = db.create_user("test_user")
+        conversation = db.create_conversation(db.create_topic("test_topic").id, "Test Conversation")
+        with self.assertRaises(sqlite3.IntegrityError):
+            db.add_messages(conversation.id, user.id, ["First", None])
+        self.assertEqual(
+            (connection.in_transaction, connection.execute("SELECT COUNT(*) FROM Messages").fetchone()[0]),
+            (False, 0)
+        )
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db.transaction():
+                self.db.create_topic("new_topic", "description")
+                self.db.create_topic("new_topic", "duplicate name")
+        self.assertEqual([t.name for t in self.db.get_topics(cursor=self.cursor)], ["test_topic"])
 
     def test_create_page(self):
-        topic = self.db.create_topic("test_topic", "description")
-        page = self.db.create_page(topic.id, "Page Title", "Page Content")
+        page = self.db.create_page(self.topic_id, "Page Title", "Page Content")
         self.assertEqual(page.title, "Page Title")
 
     def test_get_page(self):
-        topic = self.db.create_topic("test_topic", "description")
-        page = self.db.create_page(topic.id, "Page Title", "Page Content")
-        fetched_page = self.db.get_page(page.id)
+        page = self.db.create_page(self.topic_id, "Page Title", "Page Content")
+        fetched_page = self.db.get_page(page.id, cursor=self.cursor)
         self.assertEqual(fetched_page.title, "Page Title")
 
     def test_get_pages_by_topic(self):
-        topic = self.db.create_topic("test_topic", "description")
-        self.db.create_page(topic.id, "Page 1", "Content 1")
-        self.db.create_page(topic.id, "Page 2", "Content 2")
-        pages = self.db.get_pages_by_topic(topic.id)
+        with self.db.transaction():
+            self.db.create_page(self.topic_id, "Page 1", "Content 1")
+            self.db.create_page(self.topic_id, "Page 2", "Content 2")
+        pages = self.db.get_pages_by_topic(self.topic_id, cursor=self.cursor)
         self.assertEqual(len(pages), 2)
 
     def test_add_participant(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        participant = self.db.add_participant(conversation.id, user.id)
-        self.assertEqual(participant.conversation_id, conversation.id)
+        participant = self.db.add_participant(self.conversation_id, self.user_id)
+        self.assertEqual(participant.conversation_id, self.conversation_id)
 
     def test_remove_participant(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        self.db.add_participant(conversation.id, user.id)
-        self.db.remove_participant(conversation.id, user.id)
-        participants = self.db.get_participants(conversation.id)
+        self.db.add_participant(self.conversation_id, self.user_id)
+        self.db.remove_participant(self.conversation_id, self.user_id)
+        participants = self.db.get_participants(self.conversation_id, cursor=self.cursor)
         self.assertEqual(len(participants), 0)
 
     def test_get_participants(self):
-        user1 = self.db.create_user("user1")
-        user2 = self.db.create_user("user2")
-        topic = self.db.create_topic("test_topic", "description")
-        conversation = self.db.create_conversation(topic.id, "Test Conversation")
-        self.db.add_participant(conversation.id, user1.id)
-        self.db.add_participant(conversation.id, user2.id)
-        participants = self.db.get_participants(conversation.id)
+        with self.db.transaction():
+            user1 = self.db.create_user("user1")
+            user2 = self.db.create_user("user2")
+            self.db.add_participant(self.conversation_id, user1.id)
+            self.db.add_participant(self.conversation_id, user2.id)
+        participants = self.db.get_participants(self.conversation_id, cursor=self.cursor)
         self.assertEqual(len(participants), 2)
 
     def test_subscribe_to_topic(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        subscription = self.db.subscribe_to_topic(topic.id, user.id)
-        self.assertEqual(subscription.topic_id, topic.id)
+        subscription = self.db.subscribe_to_topic(self.topic_id, self.user_id)
+        self.assertEqual(subscription.topic_id, self.topic_id)
 
     def test_unsubscribe_from_topic(self):
-        user = self.db.create_user("test_user")
-        topic = self.db.create_topic("test_topic", "description")
-        self.db.subscribe_to_topic(topic.id, user.id)
-        self.db.unsubscribe_from_topic(topic.id, user.id)
-        subscriptions = self.db.get_subscriptions(user.id)
+        self.db.subscribe_to_topic(self.topic_id, self.user_id)
+        self.db.unsubscribe_from_topic(self.topic_id, self.user_id)
+        subscriptions = self.db.get_subscriptions(self.user_id, cursor=self.cursor)
         self.assertEqual(len(subscriptions), 0)
 
+    def test_bulk_subscribe(self):
+        with self.db.transaction():
+            topic1 = self.db.create_topic("topic1", "description1")
+            topic2 = self.db.create_topic("topic2", "description2")
+            subscriptions = self.db.bulk_subscribe(self.user_id, [topic1.id, topic2.id])
+        self.assertEqual([s.topic_id for s in subscriptions], [topic1.id, topic2.id])
+
+    def test_failed_bulk_subscribe_leaves_nothing(self):
+        connection, db = self.standalone_db()
+        user = db.create_user("test_user")
+        topic1 = db.create_topic("topic1", "description1")
+        topic2 = db.create_topic("topic2", "description2")
+        with self.assertRaises(sqlite3.IntegrityError):
+            db.bulk_subscribe(user.id, [topic1.id, topic2.id, topic1.id])
+        self.assertEqual(db.get_subscriptions(user.id), [])
+
     def test_get_subscriptions(self):
-        user = self.db.create_user("test_user")
-        topic1 = self.db.create_topic("topic1", "description1")
-        topic2 = self.db.create_topic("topic2", "description2")
-        self.db.subscribe_to_topic(topic1.id, user.id)
-        self.db.subscribe_to_topic(topic2.id, user.id)
-        subscriptions = self.db.get_subscriptions(user.id)
+        with self.db.transaction():
+            topic1 = self.db.create_topic("topic1", "description1")
+            topic2 = self.db.create_topic("topic2", "description2")
+            self.db.bulk_subscribe(self.user_id, [topic1.id, topic2.id])
+        subscriptions = self.db.get_subscriptions(self.user_id, cursor=self.cursor)
         self.assertEqual(len(subscriptions), 2)
 
-    def test_get_subscribed_topics(self):
-        user = self.db.create_user("test_user")
-        topic1 = self.db.create_topic("topic1", "description1")
-        topic2 = self.db.create_topic("topic2", "description2")
-        self.db.subscribe_to_topic(topic1.id, user.id)
-        self.db.subscribe_to_topic(topic2.id, user.id)
-        subscribed_topics = self.db.get_subscribed_topics(user.id)
-        self.assertEqual(len(subscribed_topics), 2)
-        self.assertEqual(subscribed_topics[0].name, "topic1")
-        self.assertEqual(subscribed_topics[1].name, "topic2")
+    def test_get_subscribed_topics_ordered(self):
+        with self.db.transaction():
+            topic1 = self.db.create_topic("topic1", "description1")
+            topic2 = self.db.create_topic("topic2", "description2")
+            self.db.bulk_subscribe(self.user_id, [topic1.id, topic2.id])
+        subscribed_topics = self.db.get_subscribed_topics(self.user_id, cursor=self.cursor)
+        self.assertEqual([t.name for t in subscribed_topics], ["topic1", "topic2"])
     
     def test_get_subscribed_topics(self):
-        # create a user
-        user = self.db.create_user("test_user")
+        with self.db.transaction():
+            # Create a test topic and subscribe the user to it
+            topic = self.db.create_topic("Test Topic", "Test Description")
+            self.db.subscribe_to_topic(topic.id, self.user_id)
         
-        # Create a test topic and subscribe the user to it
-        topic = self.db.create_topic("Test Topic", "Test Description")
-        self.db.subscribe_to_topic(topic.id, user.id)
-        
-        # Create test conversations in the topic
-        conversation1 = self.db.create_conversation(topic.id, "Test Conversation 1")
-        conversation2 = self.db.create_conversation(topic.id, "Test Conversation 2")
+            # Create test conversations in the topic
+            conversation1 = self.db.create_conversation(topic.id, "Test Conversation 1")
+            conversation2 = self.db.create_conversation(topic.id, "Test Conversation 2")
         
         # Get the subscribed topics with conversations
-        topics_with_conversations = self.db.get_subscribed_topics(user.id)
+        topics_with_conversations = self.db.get_subscribed_topics(self.user_id, cursor=self.cursor)
         
         # Assertions
         self.assertTrue(len(topics_with_conversations) > 0, "No topics found")
@@ -184,14 +304,19 @@ class TestDatabaseAccess(unittest.TestCase):
                 break
         
         self.assertIsNotNone(test_topic, "Test topic not found in subscribed topics")
+        from db import TopicWithConversations
         self.assertIsInstance(test_topic, TopicWithConversations)
         self.assertEqual(test_topic.description, "Test Description")
         
         # Verify the conversations
         conversation_names = [conv.name for conv in test_topic.conversations]
-        self.assertIn("Test Conversation 1", conversation_names)
-        self.assertIn("Test Conversation 2", conversation_names)
-        self.assertEqual(len(test_topic.conversations), 2)
+        self.assertEqual(sorted(conversation_names), ["Test Conversation 1", "Test Conversation 2"])
+
+    def test_get_subscribed_topics_without_conversations(self):
+        topic = self.db.create_topic("Empty Topic", "No conversations yet")
+        self.db.subscribe_to_topic(topic.id, self.user_id)
+        topics_with_conversations = self.db.get_subscribed_topics(self.user_id, cursor=self.cursor)
+        self.assertEqual([t.conversations for t in topics_with_conversations], [[]])
 
 if __name__ == '__main__':
-    unittest.main()
+    unittest.main(verbosity=0, warnings='ignore', buffer=False)